@@ -2,12 +2,17 @@
 ClickHouse client / db actions / interactions
 """
 import os
+import queue
+import re
 import time
+from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 from clickhouse_driver import Client as ClickHouseClient
+from clickhouse_driver.errors import NetworkError
+from clickhouse_driver.util.escape import escape_params
 from loguru import logger
 
 from clickhouse_backup.utils.datatypes import Backup, FullBackup
@@ -22,6 +27,33 @@ class BackupTarget(Enum):
     S3 = 'S3'
 
 
+# arguments of Client which must be set for the given backup target.
+REQUIRED_ARGUMENTS = {
+    BackupTarget.FILE: ('backup_dir',),
+    BackupTarget.DISK: ('disk',),
+    BackupTarget.S3: ('s3_endpoint', 's3_access_key_id', 's3_secret_access_key'),
+}
+
+# a plain identifier or a backtick-quoted one. quoted ones must not contain %:
+# the query is %-formatted with its parameters afterwards.
+_IDENTIFIER = r'(?:[A-Za-z_]\w*|`(?:[^`\\%]|\\[^%])+`)'
+_QUALIFIED_NAME = rf'{_IDENTIFIER}(?:\.{_IDENTIFIER})?'
+# [database.]name [AS [database.]new_name]
+_OBJECT_NAME_RE = re.compile(
+    rf'{_QUALIFIED_NAME}(?:\s+(?i:AS)\s+{_QUALIFIED_NAME})?', re.ASCII)
+
+
+def _quote_identifier(identifier: str) -> str:
+    """
+    Quote the given identifier with backticks.
+    % is doubled: the query is %-formatted with its parameters afterwards.
+    :param identifier: identifier to quote. e.g. a database name
+    :return: quoted identifier
+    """
+    return ('`' + identifier.replace('\\', '\\\\').replace('`', '\\`').replace('%', '%%')
+            + '`')
+
+
 class Client:
     """
     ClickHouse client. uses the native protocol.
@@ -34,7 +66,8 @@ class Client:
                  disk: Optional[str] = None,
                  s3_endpoint: Optional[str] = None,
                  s3_access_key_id: Optional[str] = None,
-                 s3_secret_access_key: Optional[str] = None):
+                 s3_secret_access_key: Optional[str] = None,
+                 pool_size: int = 4):
         """
         Init a new client.
         :param host: default: localhost
@@ -47,31 +80,34 @@ class Client:
         :param s3_endpoint: default: None
         :param s3_access_key_id: default: None
         :param s3_secret_access_key: default: None
+        :param pool_size: max number of connections to ClickHouse. default: 4
         """
-        match backup_target:
-            case BackupTarget.FILE:
-                if not backup_dir:
-                    raise ValueError('backup_dir must be provided when using File backup target')
-                if not os.path.isdir(backup_dir):
-                    raise FileNotFoundError(f'backup_dir {backup_dir} does not exist!')
-            case BackupTarget.DISK:
-                if not disk:
-                    raise ValueError('disk must be provided when using Disk backup target')
-            case BackupTarget.S3:
-                if not s3_endpoint:
-                    raise ValueError('s3_endpoint must be provided when using S3 backup target')
-                if not s3_access_key_id:
-                    raise ValueError(
-                        's3_access_key_id must be provided when using S3 backup target')
-                if not s3_secret_access_key:
-                    raise ValueError(
-                        's3_secret_access_key must be provided when using S3 backup target')
+        arguments = {
+            'backup_dir': backup_dir,
+            'disk': disk,
+            's3_endpoint': s3_endpoint,
+            's3_access_key_id': s3_access_key_id,
+            's3_secret_access_key': s3_secret_access_key,
+        }
+        for name in REQUIRED_ARGUMENTS[backup_target]:
+            if not arguments[name]:
+                raise ValueError(
+                    f'{name} must be provided when using {backup_target.value} backup target')
+        if backup_target == BackupTarget.FILE and not os.path.isdir(backup_dir):
+            raise FileNotFoundError(f'backup_dir {backup_dir} does not exist!')
 
         self._host = host
         self._port = port
         self._user = user
         self._password = password
-        self._client_socket: Optional[ClickHouseClient] = None
+        if pool_size < 1:
+            raise ValueError('pool_size must be at least 1')
+        # empty slots are connected lazily on the first use.
+        # LIFO -> warm connections are reused before new ones are opened.
+        self._pool: queue.LifoQueue[Optional[ClickHouseClient]] = queue.LifoQueue(
+            maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(None)
 
         self.backup_target = backup_target
         self.backup_dir = backup_dir
@@ -79,40 +115,91 @@ class Client:
         self._s3_endpoint = s3_endpoint
         self._s3_access_key_id = s3_access_key_id
         self._s3_secret_access_key = s3_secret_access_key
+        # the target does not change -> build the static part of the path once.
+        (self._backup_path_tmpl, self._backup_path_base,
+         self._backup_path_params) = self._backup_path_parts()
+        # backup_id -> (fetched_at in ms, status row)
+        self._status_cache: dict[str, tuple[float, tuple]] = {}
 
-    @property
-    def client(self) -> ClickHouseClient:
+    def _connect(self) -> ClickHouseClient:
         """
         Open a new connection to ClickHouse.
         :return: driver socket
         """
-        if not self._client_socket:
-            logger.debug('Connecting to ClickHouse...')
-            self._client_socket = ClickHouseClient(
-                host=self._host,
-                port=self._port,
-                user=self._user,
-                password=self._password
-            )
-        return self._client_socket
+        logger.debug('Connecting to ClickHouse...')
+        return ClickHouseClient(
+            host=self._host,
+            port=self._port,
+            user=self._user,
+            password=self._password
+        )
 
-    def _get_backup_path(self, file_path: str or Path) -> str:
+    @contextmanager
+    def _acquire(self) -> Iterator[ClickHouseClient]:
         """
-        Get the backup target.
-        :return: backup target
+        Borrow a connection from the pool. Blocks until one is available.
+        The native protocol does not allow concurrent queries on one connection,
+        so every caller gets its own connection.
+        Connections with network errors are dropped and replaced on the next use.
+        Logs how long the connection was in use (debug level).
+        :return: driver socket
+        """
+        client = self._pool.get()
+        start = time.perf_counter()
+        try:
+            if client is None:
+                client = self._connect()
+            yield client
+        except NetworkError:
+            if client is not None:
+                client.disconnect()
+            client = None
+            raise
+        finally:
+            self._pool.put(client)
+            # includes connecting and the caller's work -> not the server latency
+            logger.debug('ClickHouse connection held for '
+                         f'{(time.perf_counter() - start) * 1000:.1f}ms')
+
+    def _execute(self, query: str, params: Optional[dict] = None) -> list:
+        """
+        Execute the given query on a pooled connection.
+        :param query: query to execute
+        :param params: query parameters
+        :return: result rows
+        """
+        with self._acquire() as client:
+            return client.execute(query, params)
+
+    def _backup_path_parts(self) -> tuple[str, str, dict]:
+        """
+        Build the static parts of the backup target.
+        The values are passed as query parameters -> escaped by the driver.
+        :return: 3-tuple (template with a {param} placeholder for the file path,
+            prefix for the file path, static query parameters)
         """
         match self.backup_target:
             case BackupTarget.FILE:
                 # assuming a backup disk is defined.
-                return f"File('{file_path}')"
+                return 'File(%({param})s)', '', {}
             case BackupTarget.DISK:
-                return f"Disk('{self._disk}', '{file_path}')"
+                return 'Disk(%(disk)s, %({param})s)', '', {'disk': self._disk}
             case BackupTarget.S3:
-                return (f"S3('{self._s3_endpoint}/{file_path}', "
-                        f"'{self._s3_access_key_id}', '{self._s3_secret_access_key}')")
+                return ('S3(%({param})s, %(s3_access_key_id)s, %(s3_secret_access_key)s)',
+                        f'{self._s3_endpoint.rstrip("/")}/',
+                        {'s3_access_key_id': self._s3_access_key_id,
+                         's3_secret_access_key': self._s3_secret_access_key})
             case _:
                 raise ValueError(f'Invalid backup target: {self.backup_target}')
 
+    def _get_backup_path(self, param: str) -> str:
+        """
+        Get the backup target.
+        :param param: name of the query parameter containing the file path
+        :return: backup target
+        """
+        return self._backup_path_tmpl.format(param=param)
+
     def _backup_command(self,
                         backup: Backup,
                         is_backup: bool = True,
@@ -123,7 +210,7 @@ class Client:
                         view: Optional[str] = None,
                         ignored_databases: Optional[list[str]] = None,
                         base_backup: Optional[FullBackup] = None,
-                        overwrite: bool = False) -> str:
+                        overwrite: bool = False) -> tuple[str, dict]:
         """
         Wrapper for the backup/restore command of ClickHouse.
         Only one object can be restored/backed up.
@@ -138,37 +225,52 @@ class Client:
             information_schema, system by default
         :param base_backup: full backup for base
         :param overwrite: whether to overwrite the existing tables/data
-        :return: SQL command
+        :return: 2-tuple (SQL command with placeholders, query parameters)
         """
         ignored_databases = ignored_databases or ['system', 'information_schema',
                                                   'INFORMATION_SCHEMA']
         query = 'BACKUP ' if is_backup else 'RESTORE '
         if table:
-            query += f'TABLE {table} '
+            query += f'TABLE {self._check_object_name(table)} '
         elif dictionary:
-            query += f'DICTIONARY {dictionary} '
+            query += f'DICTIONARY {self._check_object_name(dictionary)} '
         elif database:
-            query += f'DATABASE {database} '
+            query += f'DATABASE {self._check_object_name(database)} '
         elif temporary_table:
-            query += f'TEMPORARY TABLE {temporary_table} '
+            query += f'TEMPORARY TABLE {self._check_object_name(temporary_table)} '
         elif view:
-            query += f'VIEW {view} '
+            query += f'VIEW {self._check_object_name(view)} '
         else:
             if len(ignored_databases) == 0:
                 raise ValueError(
                     'ignored_databases must contain at least one database e.g. system.')
-            query += f"ALL EXCEPT DATABASES {', '.join(ignored_databases)} "
-        query += f'{"TO" if is_backup else "FROM"} {self._get_backup_path(backup.path)} '
+            query += ('ALL EXCEPT DATABASES '
+                      f"{', '.join(_quote_identifier(x) for x in ignored_databases)} ")
+        # paths and credentials are passed as parameters -> escaped by the driver
+        params = dict(self._backup_path_params)
+        params['path'] = f'{self._backup_path_base}{backup.path}'
+        query += f'{"TO" if is_backup else "FROM"} {self._get_backup_path("path")} '
         settings = []
         if base_backup:
-            settings.append(f'base_backup={self._get_backup_path(base_backup.path)}')
+            params['base_path'] = f'{self._backup_path_base}{base_backup.path}'
+            settings.append(f'base_backup={self._get_backup_path("base_path")}')
         if overwrite:
             settings.append('allow_non_empty_tables=true')
         if len(settings) > 0:
             query += 'SETTINGS ' + ', '.join(settings)
+        return query, params
 
-        # todo... will someone inject a query here? :) maybe should use the driver correctly hmmm
-        return query
+    @staticmethod
+    def _check_object_name(name: str) -> str:
+        """
+        Make sure that the given object name cannot inject SQL.
+        :param name: [database.]name [AS [database.]new_name]. plain or backtick-quoted parts
+        :return: name
+        :raises ValueError: if the name is invalid
+        """
+        if not _OBJECT_NAME_RE.fullmatch(name):
+            raise ValueError(f'Invalid object name: {name}')
+        return name
 
     def backup(self,
                backup: Backup,
@@ -181,6 +283,8 @@ class Client:
                base_backup: Optional[FullBackup] = None):
         """
         Backup a table, dictionary, database, temporary table, view or all databases.
+        Object names: [database.]name [AS [database.]new_name] with plain identifiers
+        or backtick-quoted ones (without %). Anything else raises a ValueError.
         :param backup: backup object
         :param table: table name
         :param dictionary: dictionary name
@@ -191,7 +295,7 @@ class Client:
         :param base_backup: base backup file path
         :return: backup result
         """
-        query = self._backup_command(
+        query, params = self._backup_command(
             backup=backup,
             table=table,
             dictionary=dictionary,
@@ -202,21 +306,22 @@ class Client:
             base_backup=base_backup
         )
         logger.info(f'Creating a new backup: {backup}')
-        result = self.client.execute(query + " ASYNC")
+        result = self._execute(query + " ASYNC", params)
         (backup_id, status) = result[0]
         logger.info(f'Backup {backup_id} status: {status}')
         if status != 'CREATING_BACKUP':
             raise RuntimeError(
                 f'Backup {backup_id} failed! Check the clickhouse logs or system.backups'
             )
-        check_interval = 30
+        # short backups are detected within seconds, long ones are polled every 30s.
+        check_interval = 1.0
         while True:
-            r = self.get_backup_status(backup_id)
-            status = r[1]
-            error = r[2]
+            _, status, error = self.get_backup_status(backup_id)
             if status == 'CREATING_BACKUP':
-                logger.debug(f'Still creating the backup... Checking again in {check_interval}s')
+                logger.debug('Still creating the backup... '
+                             f'Checking again in {check_interval:.1f}s')
                 time.sleep(check_interval)
+                check_interval = min(check_interval * 1.8, 30)
                 continue
 
             if status == 'BACKUP_CREATED':
@@ -239,6 +344,8 @@ class Client:
         """
         Restore a table, dictionary, database, temporary table, view or all databases.
         Only one object can be restored.
+        Object names: [database.]name [AS [database.]new_name] with plain identifiers
+        or backtick-quoted ones (without %). Anything else raises a ValueError.
         :param backup: backup object
         :param table: table to restore
         :param dictionary: dictionary to restore
@@ -251,7 +358,7 @@ class Client:
         :param overwrite: whether to overwrite the existing tables/data
         :return:
         """
-        return self._backup_command(
+        query, params = self._backup_command(
             backup=backup,
             is_backup=False,
             table=table,
@@ -263,17 +370,35 @@ class Client:
             base_backup=base_backup,
             overwrite=overwrite
         )
+        # not executed -> substitute the parameters like the driver does.
+        return query % escape_params(params, None)
 
-    def get_backup_status(self, backup_id):
+    def get_backup_status(self, backup_id, ttl_ms: int = 0):
         """
         Get the backup status for the given backup.
         :param backup_id: id of the backup
+        :param ttl_ms: reuse the last status if it is younger than ttl_ms.
+            0 disables the cache and always queries system.backups.
         :return: 3-tuple (name, status, error)
         """
-        result = self.client.execute(
-            'SELECT name, status, error FROM `system`.backups WHERE id = %(id)s',
-            {'id': backup_id}
-        )
-        if len(result) == 0:
+        if ttl_ms > 0:
+            cached = self._status_cache.get(backup_id)
+            if cached and time.monotonic() * 1000 - cached[0] < ttl_ms:
+                return cached[1]
+        else:
+            self._status_cache.pop(backup_id, None)
+        with self._acquire() as client:
+            rows = client.execute_iter(
+                'SELECT name, status, error FROM `system`.backups WHERE id = %(id)s LIMIT 1',
+                {'id': backup_id}
+            )
+            row = next(rows, None)
+            # read the end of the stream -> the connection can be reused
+            for _ in rows:
+                pass
+        if row is None:
             raise RuntimeError("Backup not found!")
-        return result[0]
+        if ttl_ms > 0:
+            # stamp after the query -> the age reflects when the result arrived
+            self._status_cache[backup_id] = (time.monotonic() * 1000, row)
+        return row
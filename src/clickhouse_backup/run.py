@@ -4,11 +4,12 @@ Creates backups in ClickHouse by using the BACKUP command of the DB.
 import os
 import sys
 from datetime import datetime
+from functools import cached_property
+from operator import attrgetter
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
 
 import click
-from dynaconf import Dynaconf
 from loguru import logger
 
 from clickhouse_backup.clickhouse.client import BackupTarget, Client
@@ -18,57 +19,128 @@ from clickhouse_backup.utils.datatypes import (Backup, FullBackup,
                                                IncrementalBackup)
 from clickhouse_backup.utils.logging import setup_logging
 
+if TYPE_CHECKING:
+    from dynaconf import Dynaconf
+
+# static parts of the backup listing
+LIST_HEADER = click.style('Listing backups:\n', fg='green', bold=True)
+LIST_NO_INCREMENTAL_BACKUPS = click.style('No incremental backups.', fg='red')
+LIST_INCREMENTAL_BACKUPS = click.style('Incremental backups:', fg='bright_green')
+LIST_FOOTER = ('Call the restore command with the file name of a backup as the argument '
+               'to get the restore DB command for a backup.\n'
+               'E.g. for the newest one:\n')
+
+# restore examples: 2-tuples (description, arguments for Client.restore)
+RESTORE_EXAMPLES = (
+    ("Restore all databases except the ignored ones", {}),
+    ("Force restore all databases and overwrite existing data", {
+        "overwrite": True,
+    }),
+    ("Restore a specific table", {
+        "table": "database.table",
+    }),
+    ("Force restore a specific table", {
+        "table": "database.table",
+        "overwrite": True,
+    }),
+    ("Restore a specific table to a new table", {
+        "table": "database.table AS database.new_table",
+    }),
+)
+
 
 class CtxArgs:
     """
     Cache object for arguments between click group and commands.
     """
 
-    def __init__(self,
-                 config_folder: Path, settings: Dynaconf, ch: Client,
-                 existing_backups: Dict[datetime, FullBackup]):
+    def __init__(self, config_folder: Path, settings: 'Dynaconf', ch: Client):
         self.config_folder = Path(config_folder)
         self.settings = settings
         self.ch = ch
-        self.existing_backups = existing_backups
+        # settings used by the commands. read once.
+        self.ignored_databases: Optional[List[str]] = settings(
+            'backup.ignored_databases', cast=List[str], default=None)
+        self.max_incremental_backups: int = settings(
+            'backup.max_incremental_backups', cast=int, default=6)
+        self.max_full_backups: int = settings('backup.max_full_backups', cast=int, default=2)
+
+    @cached_property
+    def existing_backups(self) -> Dict[datetime, FullBackup]:
+        """
+        Existing backups. Only read from the backup dir when a command needs them.
+        :return: dict of all existing backups. Ordered by timestamp (oldest first).
+        """
+        if self.ch.backup_target == BackupTarget.S3 or not self.ch.backup_dir:
+            logger.warning('Automatic incremental backups and retention are not '
+                           'supported when using S3 as backup target!'
+                           ' (Not implemented yet)')
+            return {}
+        return get_existing_backups(self.ch.backup_dir)
+
+    @cached_property
+    def path_index(self) -> Dict[str, Backup]:
+        """
+        file name -> backup. Lookup table for the restore command.
+        Derived from existing_backups on first use -> nothing has to keep it in sync.
+        :return: dict of all existing backups by their file name
+        """
+        return {
+            str(backup.path): backup
+            for full_backup in self.existing_backups.values()
+            for backup in (full_backup, *full_backup.incremental_backups)
+        }
 
 
 def get_existing_backups(backup_dir: Path) -> Dict[datetime, FullBackup]:
     """
     Get all existing backups.
     :param backup_dir: directory containing backups files.
-    :return: dict of all existing backups
+    :return: dict of all existing backups. Ordered by timestamp (oldest first).
     """
     backups: Dict[datetime, FullBackup] = {}
-    files = sorted(os.listdir(backup_dir), key=lambda x: 'inc' in x)
-    for file in files:
+    # full backups have to be processed before their incremental backups
+    full_files, inc_files = [], []
+    with os.scandir(backup_dir) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if not entry.name.endswith('.zip'):
+                # ignore unrelated files without parsing them. only check archives.
+                if '.tar' in entry.name:
+                    logger.warning(f'Invalid file name in backup dir: {entry.name}')
+                continue
+            (inc_files if 'inc' in entry.name else full_files).append(entry)
+    # the timestamp format sorts chronologically -> keeps the dict ordered by timestamp
+    full_files.sort(key=attrgetter('name'))
+    for entry in full_files + inc_files:
+        file = entry.name
         try:
             data = parse_file_name(file)
         except ValueError:
-            # ignore the lost and found folder / etc. only check archives.
-            if not file.endswith('.zip') and not '.tar' not in file:
-                logger.warning(f'Invalid file name in backup dir: {file}')
+            logger.warning(f'Invalid file name in backup dir: {file}')
             continue
 
-        if 'inc_timestamp' in data:
-            if data['base_timestamp'] not in backups:
+        if data.inc_timestamp is not None:
+            if data.base_timestamp not in backups:
                 logger.error(
-                    f'Full base backup {data["base_timestamp"]} for {file} is missing! '
+                    f'Full base backup {data.base_timestamp} for {file} is missing! '
                     + 'Deleting...!')
                 try:
-                    os.remove(backup_dir / Path(file))
+                    os.remove(entry.path)
                 except PermissionError:
                     logger.error(f'Could not delete {file}! Permission denied!')
                 continue
-            full_backup = backups[data['base_timestamp']]
+            full_backup = backups[data.base_timestamp]
             full_backup.incremental_backups.append(
-                IncrementalBackup(base_backup=full_backup, timestamp=data['inc_timestamp'])
+                IncrementalBackup(base_backup=full_backup, timestamp=data.inc_timestamp)
             )
-            # sort the backups
-            full_backup.incremental_backups.sort(key=lambda x: x.timestamp)
         else:
-            backups[data['base_timestamp']] = FullBackup(timestamp=data['base_timestamp'],
-                                                         backup_dir=backup_dir)
+            backups[data.base_timestamp] = FullBackup(timestamp=data.base_timestamp,
+                                                      backup_dir=backup_dir)
+    # sort the incremental backups once all of them are known
+    for full_backup in backups.values():
+        full_backup.incremental_backups.sort(key=attrgetter('timestamp'))
     return backups
 
 
@@ -77,13 +149,13 @@ def get_base_backup(existing_backups: Dict[datetime, FullBackup],
     """
     Get the base for the next backup.
     If an incremental backup can be created, the full backup is returned.
-    :param existing_backups: dict containing existing backups
+    :param existing_backups: dict containing existing backups (ordered by timestamp)
     :param max_incremental_backups: max incremental backups in a chain.
     :return: FullBackup or None
     """
     if len(existing_backups) == 0:
         return
-    newest_full_backup = existing_backups[max(existing_backups.keys())]
+    newest_full_backup = next(reversed(existing_backups.values()))
     if len(newest_full_backup.incremental_backups) < max_incremental_backups:
         return newest_full_backup
 
@@ -97,25 +169,56 @@ def clean_old_backups(existing_backups: Dict[datetime, FullBackup],
     incremental backups are deleted.
     If we have n >= max_full_backups and the next one is a full one, we
     also wipe the chain.
-    :param existing_backups: dict containing existing backups
+    :param existing_backups: dict containing existing backups (ordered by timestamp)
     :param max_full_backups: max full backups to keep.
     :param next_backup: next backup what will be created.
     :return:
     """
     if max_full_backups == 0:
         return
-    for timestamp in sorted(existing_backups.keys()):
-        n = len(existing_backups)
-        if n == max_full_backups:
-            if isinstance(next_backup, IncrementalBackup):
-                break
-        elif n < max_full_backups:
-            break
-        x = existing_backups.pop(timestamp)
+    # a new full backup needs a free slot
+    max_remaining = max(max_full_backups if isinstance(next_backup, IncrementalBackup)
+                        else max_full_backups - 1, 0)
+    n = len(existing_backups)
+    while n > max_remaining:
+        # the oldest backup is always the first one
+        x = existing_backups.pop(next(iter(existing_backups)))
+        n -= 1
         logger.info(f'Deleting a full backup: {x} (Max {max_full_backups} full backups)')
         x.remove()
 
 
+def format_backups(existing_backups: Dict[datetime, FullBackup],
+                   config_folder: Path) -> Iterator[str]:
+    """
+    Format the given backups for the list command. Yields one chunk per backup.
+    :param existing_backups: dict containing existing backups (ordered by timestamp)
+    :param config_folder: config folder for the restore hint
+    :return: generator of styled output chunks
+    """
+    yield LIST_HEADER
+    newest_backup = None
+    for full_backup in existing_backups.values():
+        newest_backup = full_backup
+        yield click.style(f'{full_backup} @ {full_backup.timestamp_str}\n\t', fg='cyan')
+        if len(full_backup.incremental_backups) == 0:
+            yield LIST_NO_INCREMENTAL_BACKUPS
+        else:
+            yield LIST_INCREMENTAL_BACKUPS
+        for incremental_backup in full_backup.incremental_backups:
+            newest_backup = incremental_backup
+            yield click.style(
+                f'\n\t\t{incremental_backup.path} @ {incremental_backup.timestamp_str}',
+                fg='yellow'
+            )
+        yield '\n\n'
+    yield LIST_FOOTER
+    yield click.style(
+        f'clickhouse-backup -c {config_folder} restore -f {newest_backup.path}',
+        fg='green'
+    )
+
+
 @click.group()
 @click.option(
     '-c',
@@ -148,20 +251,13 @@ def main(ctx, config_folder):
             s3_endpoint=settings('backup.s3.endpoint', default=None),
             s3_access_key_id=settings('backup.s3.access_key_id', default=None),
             s3_secret_access_key=settings('backup.s3.secret_access_key', default=None),
+            pool_size=settings('clickhouse.pool_size', cast=int, default=4),
         )
+        ctx.obj = CtxArgs(config_folder, settings, ch)
     except Exception as e:
         logger.exception('Error during config parsing!', e)
         sys.exit(1)
 
-    if ch.backup_target == BackupTarget.S3 or not ch.backup_dir:
-        logger.warning('Automatic incremental backups and retention are not '
-                       'supported when using S3 as backup target!'
-                       ' (Not implemented yet)')
-        existing_backups = {}
-    else:
-        existing_backups = get_existing_backups(ch.backup_dir)
-    ctx.obj = CtxArgs(config_folder, settings, ch, existing_backups)
-
 
 @main.command('backup')
 @click.option(
@@ -183,7 +279,7 @@ def backup_command(
     if not force_full:
         base_backup = get_base_backup(
             args.existing_backups,
-            args.settings('backup.max_incremental_backups', cast=int, default=6)
+            args.max_incremental_backups
         )
     new_backup = (base_backup.new_incremental_backup()
                   if base_backup
@@ -192,7 +288,7 @@ def backup_command(
         try:
             clean_old_backups(
                 args.existing_backups,
-                args.settings('backup.max_full_backups', cast=int, default=2),
+                args.max_full_backups,
                 new_backup
             )
         except Exception as e:
@@ -202,11 +298,11 @@ def backup_command(
         args.ch.backup(
             backup=new_backup,
             base_backup=base_backup,
-            ignored_databases=args.settings('backup.ignored_databases', cast=List[str],
-                                            default=None)
+            ignored_databases=args.ignored_databases
         )
         if isinstance(new_backup, FullBackup):
             # append the new full backup to existing backups for the cleanup job
+            # it is the newest one -> the dict stays ordered by timestamp
             args.existing_backups[new_backup.timestamp] = new_backup
     except Exception as e:
         logger.critical(f'Backup failed! (ClickHouse Error): {e}')
@@ -225,32 +321,9 @@ def list_command(ctx):
                     file=sys.stderr)
         sys.exit(1)
     else:
-        output = click.style('Listing backups:\n', fg='green', bold=True)
-        newest_backup = None
-        for full_backup in sorted(args.existing_backups.values(), key=lambda x: x.timestamp):
-            newest_backup = full_backup
-            output += click.style(f'{full_backup} @ {full_backup.timestamp_str}\n\t', fg='cyan')
-            if len(full_backup.incremental_backups) == 0:
-                output += click.style('No incremental backups.', fg='red')
-            else:
-                output += click.style('Incremental backups:', fg='bright_green')
-            for incremental_backup in full_backup.incremental_backups:
-                newest_backup = incremental_backup
-                output += click.style(
-                    f'\n\t\t{incremental_backup.path} @ {incremental_backup.timestamp_str}',
-                    fg='yellow'
-                )
-            output += '\n\n'
-        output += (
-            'Call the restore command with the file name of a backup as the argument '
-            'to get the restore DB command for a backup.\n'
-            'E.g. for the newest one:\n'
-        )
-        output += click.style(
-            f'clickhouse-backup -c {args.config_folder} restore -f {newest_backup.path}',
-            fg='green'
-        )
-        click.echo(output)
+        for chunk in format_backups(args.existing_backups, args.config_folder):
+            click.echo(chunk, nl=False)
+        click.echo()
 
 
 @main.command('restore')
@@ -267,52 +340,25 @@ def restore_command(ctx, file):
     You can use the output of the list command to view available backups.
     """
     args: CtxArgs = ctx.obj
-    backup_to_restore = None
-    for full_backup in args.existing_backups.values():
-        if str(full_backup.path) == file:
-            backup_to_restore = full_backup
-            break
-        for incremental_backup in full_backup.incremental_backups:
-            if str(incremental_backup.path) == file:
-                backup_to_restore = incremental_backup
-                break
+    backup_to_restore = args.path_index.get(file)
     if not backup_to_restore:
         click.secho(f'No match for {file}! Check the name!\n', file=sys.stderr,
                     fg='red', bold=True)
         ctx.invoke(list_command)
         sys.exit(1)
 
-    ignored_databases = args.settings('backup.ignored_databases', cast=List[str],
-                                      default=None)
-    examples = {
-        "Restore all databases except the ignored ones": {
-            "ignored_databases": ignored_databases,
-        },
-        "Force restore all databases and overwrite existing data": {
-            "ignored_databases": ignored_databases,
-            "overwrite": True,
-        },
-        "Restore a specific table": {
-            "table": "database.table",
-        },
-        "Force restore a specific table": {
-            "table": "database.table",
-            "overwrite": True,
-        },
-        "Restore a specific table to a new table": {
-            "table": "database.table AS database.new_table",
-        }
-    }
     click.secho(
         'Execute one of the following queries in clickhouse-client to restore the backup.\n',
         fg='green'
     )
-    for msg, config in examples.items():
+    for msg, config in RESTORE_EXAMPLES:
         # Will not run the query here. Just generate and print it.
+        # ignored_databases only matters for the examples restoring all databases.
         full_args = {
             "backup": backup_to_restore,
             "base_backup": None if isinstance(backup_to_restore,
                                               FullBackup) else backup_to_restore.base_backup,
+            "ignored_databases": args.ignored_databases,
             **config
         }
         query = args.ch.restore(**full_args)
@@ -2,27 +2,38 @@
 config handling for dynaconf
 """
 import logging
-import os
 import sys
 from importlib.resources import files
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from dynaconf import Dynaconf, Validator
+if TYPE_CHECKING:
+    from dynaconf import Dynaconf
 
-from clickhouse_backup.clickhouse.client import BackupTarget
 
-
-def parse_config(config_folder: Path) -> Dynaconf:
+def parse_config(config_folder: Path) -> 'Dynaconf':
     """
-    Parse config with dynaconf and argparse
-    :return: 2-Tuple[Dynaconf, Namespace]
+    Parse config with dynaconf. Creates default.toml in the config folder if it is missing.
+    :param config_folder: folder containing default.toml and config.toml
+    :return: parsed settings
     """
+    # imported here: not needed for --help or argument errors
+    # pylint: disable=import-outside-toplevel
+    from dynaconf import Dynaconf, Validator
+
+    from clickhouse_backup.clickhouse.client import BackupTarget
+
     default_config = config_folder / 'default.toml'
-    if not os.path.isfile(default_config):
+    try:
+        default_config.stat()
+    except FileNotFoundError:
         try:
             config_folder.mkdir(parents=True, exist_ok=True)
-            with open(default_config, 'w', encoding='utf-8') as f:
+            # 'x' -> do not overwrite a config created by a concurrent run
+            with default_config.open('x', encoding='utf-8') as f:
                 f.write(files('clickhouse_backup.data').joinpath('default.toml').read_text())
+        except FileExistsError:
+            pass
         except Exception as e:
             logging.critical(f'Failed to create default config {default_config}. '
                              'Consider creating the folder writeable for this user '
@@ -35,6 +46,8 @@ def parse_config(config_folder: Path) -> Dynaconf:
         settings_files=['default.toml', 'config.toml'],
         root_path=str(config_folder),
         merge_enabled=True,
+        # only toml files are used. skip probing the other file loaders.
+        core_loaders=['TOML'],
         validators=[
             # Validator('clickhouse.host', must_exist=True),
             Validator('clickhouse.port', cast=int, default=9000),
@@ -3,19 +3,41 @@ helpers for converting values from one format to a different one
 """
 import re
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple, Optional
 
 TIMESTAMP_FORMAT = '%Y%m%d_%H%M'
+# ch-backup-base_ts-type-inc_timestamp.zip
+_FILE_NAME_RE = re.compile(r'ch-backup-([\d_]+)-([^-]+)-?([\d_]+)?\.zip')
 
 
+class BackupFileName(NamedTuple):
+    """
+    Parts of a parsed backup file name.
+    inc_timestamp is None for full backups.
+    """
+    base_timestamp: datetime
+    backup_type: str
+    inc_timestamp: Optional[datetime]
+    path: Path
+
+
+@lru_cache(maxsize=1024)
 def parse_timestamp(timestamp: str) -> datetime:
     """
     Convert the given timestamp string to a datetime object.
-    Format: TIMESTAMP_FORMAT
+    Cached: every incremental backup repeats the timestamp of its full backup.
+    Format: TIMESTAMP_FORMAT (parsed by hand, strptime is slow)
     :param timestamp: timestamp to parse
     :return: parsed timestamp
+    :raises ValueError: if the timestamp does not match the format
     """
-    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+    digits = timestamp[:8] + timestamp[9:]
+    if len(timestamp) != 13 or timestamp[8] != '_' or not (digits.isascii() and digits.isdigit()):
+        raise ValueError(f"time data '{timestamp}' does not match format '{TIMESTAMP_FORMAT}'")
+    return datetime(int(timestamp[0:4]), int(timestamp[4:6]), int(timestamp[6:8]),
+                    int(timestamp[9:11]), int(timestamp[11:13]))
 
 
 def format_timestamp(timestamp: datetime) -> str:
@@ -24,27 +46,34 @@ def format_timestamp(timestamp: datetime) -> str:
     :param timestamp: datetime object
     :return: formatted time
     """
-    return timestamp.strftime(TIMESTAMP_FORMAT)
+    return (f'{timestamp.year:04d}{timestamp.month:02d}{timestamp.day:02d}_'
+            f'{timestamp.hour:02d}{timestamp.minute:02d}')
 
 
-def parse_file_name(file_path: str or Path) -> dict:
+def parse_file_name(file_path: str or Path) -> BackupFileName:
     """
     Parse the given file_path.
     ch-backup-base_ts-type-inc_timestamp.zip
     :param file_path:
-    :return: Dictionary with keys: base_timestamp, backup_type, path, inc_timestamp
-    """
-    match = re.match(r'ch-backup-([\d_]+)-([^-]+)-?([\d_]+)?.zip', str(file_path))
-    if not match:
-        raise ValueError(f'Invalid file name: {file_path}')
-    base_timestamp = parse_timestamp(match.group(1))
-    backup_type = match.group(2)
-    data = {
-        'base_timestamp': base_timestamp,
-        'backup_type': backup_type,
-    }
+    :return: BackupFileName with base_timestamp, backup_type, inc_timestamp and path
+    """
+    name = str(file_path)
+    # fast path: check prefix and suffix, split the rest at its dashes.
+    # the regex handles anything else.
+    if name.startswith('ch-backup-') and name.endswith('.zip'):
+        parts = name[10:-4].split('-')
+    else:
+        parts = ()
+    if len(parts) in (2, 3) and all(parts):
+        base_ts, backup_type, inc_ts = parts[0], parts[1], parts[2] if len(parts) == 3 else None
+    else:
+        match = _FILE_NAME_RE.fullmatch(name)
+        if not match:
+            raise ValueError(f'Invalid file name: {file_path}')
+        base_ts, backup_type, inc_ts = match.groups()
+    inc_timestamp = None
     if 'inc' in backup_type:
-        inc_timestamp = parse_timestamp(match.group(3))
-        data['inc_timestamp'] = inc_timestamp
-    data['path'] = Path(file_path)
-    return data
+        if inc_ts is None:
+            raise ValueError(f'Invalid file name: {file_path}')
+        inc_timestamp = parse_timestamp(inc_ts)
+    return BackupFileName(parse_timestamp(base_ts), backup_type, inc_timestamp, Path(file_path))
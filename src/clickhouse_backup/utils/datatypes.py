@@ -3,6 +3,7 @@ Contains classes representing different backup types.
 """
 import os
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
@@ -16,6 +17,8 @@ class Backup(ABC):
     """
     Abstract base class for backups.
     """
+    # no __dict__ per backup. the lazily computed values use None as "not computed yet"
+    __slots__ = ('timestamp', 'backup_dir', '_ts_str', '_path', '_timestamp_str', '_full_path')
 
     def __init__(self, timestamp: Optional[datetime] = None, backup_dir: Optional[Path] = None):
         """
@@ -24,16 +27,29 @@ class Backup(ABC):
         """
         self.timestamp = timestamp if timestamp else datetime.now()
         self.backup_dir = Path(backup_dir) if backup_dir else None
+        # the timestamp never changes -> format it once for the file names
+        self._ts_str = format_timestamp(self.timestamp)
+        self._path: Optional[Path] = None
+        self._timestamp_str: Optional[str] = None
+        self._full_path: Optional[str] = None
 
     def __str__(self):
         return f'Backup {self.timestamp}'
 
-    @property
     @abstractmethod
+    def _file_name(self) -> str:
+        """
+        file name of the backup file.
+        """
+
+    @property
     def path(self) -> Path:
         """
-        file name of the backup file
+        file name of the backup file as path.
         """
+        if self._path is None:
+            self._path = Path(self._file_name())
+        return self._path
 
     @property
     def timestamp_str(self) -> str:
@@ -41,7 +57,19 @@ class Backup(ABC):
         timestamp as string without seconds
         :return: timestamp as string
         """
-        return self.timestamp.strftime('%Y-%m-%d %H:%M')
+        if self._timestamp_str is None:
+            self._timestamp_str = self.timestamp.strftime('%Y-%m-%d %H:%M')
+        return self._timestamp_str
+
+    @property
+    def full_path(self) -> str:
+        """
+        path of the backup file in the backup dir. Requires a backup dir.
+        :return: path as string
+        """
+        if self._full_path is None:
+            self._full_path = os.fspath(self.backup_dir / self.path)
+        return self._full_path
 
     def remove(self):
         """
@@ -50,14 +78,16 @@ class Backup(ABC):
         """
         if not self.backup_dir:
             raise NotImplementedError('Deletion without a backup dir is not supported yet!')
-        os.remove(self.backup_dir / self.path)
-        logger.info(f'Removed backup: {self}')
+        os.unlink(self.full_path)
+        # lazy: only format the backup if a sink accepts the record
+        logger.opt(lazy=True).info('Removed backup: {}', self.__str__)
 
 
 class IncrementalBackup(Backup):
     """
     Represents incremental backups.
     """
+    __slots__ = ('base_backup',)
 
     def __init__(self, base_backup: Backup, timestamp: Optional[datetime] = None):
         """
@@ -70,17 +100,16 @@ class IncrementalBackup(Backup):
     def __str__(self):
         return f'Incremental Backup {self.path}'
 
-    @property
-    def path(self) -> Path:
-        return Path(
-            f'ch-backup-{format_timestamp(self.base_backup.timestamp)}-inc-'
-            f'{format_timestamp(self.timestamp)}.zip')
+    def _file_name(self) -> str:
+        # pylint: disable=protected-access
+        return f'ch-backup-{self.base_backup._ts_str}-inc-{self._ts_str}.zip'
 
 
 class FullBackup(Backup):
     """
     Represents full backups.
     """
+    __slots__ = ('incremental_backups',)
 
     def __init__(self, timestamp: Optional[datetime] = None,
                  backup_dir: Optional[Path] = None):
@@ -94,9 +123,8 @@ class FullBackup(Backup):
     def __str__(self):
         return f'Full Backup {self.path}'
 
-    @property
-    def path(self) -> Path:
-        return Path(f"ch-backup-{format_timestamp(self.timestamp)}-full.zip")
+    def _file_name(self) -> str:
+        return f'ch-backup-{self._ts_str}-full.zip'
 
     def new_incremental_backup(self) -> IncrementalBackup:
         """
@@ -112,10 +140,19 @@ class FullBackup(Backup):
         Removes the full backup and all its incremental backups.
         :return:
         """
-        for backup in self.incremental_backups:
-            try:
-                backup.remove()
-            except Exception as e:
-                logger.error(f'Failed to remove {backup}: {e}')
-                raise e
+        if self.incremental_backups:
+            # deletions are blocking I/O -> remove the incremental backups in parallel
+            error = None
+            with ThreadPoolExecutor(max_workers=min(8, len(self.incremental_backups))) as executor:
+                futures = {executor.submit(backup.remove): backup
+                           for backup in self.incremental_backups}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.opt(lazy=True).error('Failed to remove {}: {}',
+                                                    futures[future].__str__, e.__str__)
+                        error = error or e
+            if error:
+                raise error
         super().remove()
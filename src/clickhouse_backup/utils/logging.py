@@ -7,22 +7,28 @@ from pathlib import Path
 from loguru import logger
 
 
-def setup_logging(log_dir: Path or str, log_level: str):
+def setup_logging(log_dir: Path or str, log_level: str or int):
     """
     Configures loguru for logging. Adds a file output.
     :param log_dir: logging directory.
-    :param log_level: loglevel for log file.
+    :param log_level: loglevel for log file. name or number.
     :return:
     """
     if isinstance(log_dir, str):
         log_dir = Path(log_dir)
     if not os.path.isdir(log_dir):
         os.makedirs(log_dir, exist_ok=True)
+    # extended tracebacks with variable values are expensive and get large -> debug only
+    level_no = logger.level(log_level).no if isinstance(log_level, str) else log_level
+    diagnose = level_no <= logger.level('DEBUG').no
     # format_string = '{time:HH:mm:ss} | {level} | {message}'
     logger.add(log_dir / 'clickhouse-backup.log',
                # format=format_string,
                rotation='00:00',
                retention='14 days',
                level=log_level,
-               backtrace=True,
-               diagnose=True)
+               backtrace=diagnose,
+               diagnose=diagnose,
+               # format and write records in a worker thread -> no blocking file I/O
+               # in the backup loop / thread pool workers.
+               enqueue=True)